@@ -1,43 +1,152 @@
-try:
-	from board import SCL, SDA
-	import busio
-	from PIL import Image, ImageDraw, ImageFont
-	import adafruit_ssd1306
-	noDisplayLibraries = False
-except ImportError:
-	noDisplayLibraries = True
+import collections
+import fcntl
+import os
+
+# The display libraries are slow to import, so they are only loaded by startDisplay(),
+# turning the display off with shutdownDisplay(None) doesn't need them
+noDisplayLibraries = True
+
+def loadDisplayLibraries():
+	global noDisplayLibraries, SCL, SDA, busio, Image, ImageDraw, ImageFont, adafruit_ssd1306
+	try:
+		from board import SCL, SDA
+		import busio
+		from PIL import Image, ImageDraw, ImageFont
+		import adafruit_ssd1306
+		noDisplayLibraries = False
+	except ImportError:
+		noDisplayLibraries = True
 
 # This additional file is to support the functionality for an external display
 # If you only want to have the LEDs light up, then you do not need this file
 
+# The I2C bus speed on the Raspberry Pi is set with dtparam=i2c_arm_baudrate in
+# /boot/config.txt, see the README for running the display in 400kHz fast mode
+
+# I2C address of the SSD1306, 0x3C unless the address jumper on the display was changed
+DISPLAY_ADDRESS = 0x3C
+# I2C bus device the display is connected to, bus 1 on the Raspberry Pi header pins
+I2C_DEVICE = '/dev/i2c-1'
+# ioctl request that selects the device address for the following reads and writes
+I2C_SLAVE = 0x0703
+
+FONT_LARGE_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf'
+FONT_SMALL_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf'
+
+# Fonts are loaded once in startDisplay() and reused for every frame
+fontLarge = None
+fontSmall = None
+
+# Rendered frames are kept in a small LRU cache so rotating back to a station
+# whose METAR hasn't changed is a single blit instead of a full redraw
+FRAME_CACHE_SIZE = 64
+frameCache = collections.OrderedDict()
+
+# Copy of the framebuffer last sent to the display, only the region that differs
+# from it is written out on the next update
+prevBuffer = None
+# Above this fraction of changed framebuffer a full refresh is cheaper
+FULL_REFRESH_RATIO = 0.75
+# Key of the frame currently on the display, showing the same frame again is a no-op
+lastFrameKey = None
+
 def startDisplay():
+	global fontLarge, fontSmall
+	loadDisplayLibraries()
 	if noDisplayLibraries:
 		return None
 
 	i2c = busio.I2C(SCL, SDA)
-	disp = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c)
+	disp = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c, addr=DISPLAY_ADDRESS)
 	disp.poweron()
+	fontLarge = ImageFont.truetype(FONT_LARGE_PATH, 16)
+	fontSmall = ImageFont.truetype(FONT_SMALL_PATH, 10)
 	return disp
 	
 def shutdownDisplay(disp):
-	if noDisplayLibraries:
+	if disp is not None:
+		disp.poweroff()
 		return
 
-	disp.poweroff()
+	# Without a started display only the display off command (0xAE) is written straight to
+	# the I2C bus device, this needs none of the display libraries and skips the bus setup,
+	# initialization, font loading and screen clearing that startDisplay() does
+	try:
+		fd = os.open(I2C_DEVICE, os.O_RDWR)
+	except OSError:
+		return
+	try:
+		fcntl.ioctl(fd, I2C_SLAVE, DISPLAY_ADDRESS)
+		os.write(fd, b'\x00\xAE')
+	except OSError:
+		# No display answering on the bus, there is nothing to turn off
+		pass
+	finally:
+		os.close(fd)
 
 def clearScreen(disp):
+	global lastFrameKey
 	if noDisplayLibraries:
 		return
 
+	lastFrameKey = None
 	disp.fill(0)
-	disp.show()
-	
-def outputMetar(disp, station, condition):
-	if noDisplayLibraries:
-		return
+	flushDisplay(disp)
 
+def flushDisplay(disp):
+	global prevBuffer
+	# disp.buffer holds the 0x40 data control byte followed by one row of columns per page
+	buf = disp.buffer
 	width = disp.width
-	height = disp.height
+	pages = disp.height // 8
+	if prevBuffer is None or len(prevBuffer) != len(buf):
+		disp.show()
+		prevBuffer = bytearray(buf)
+		return
+
+	# Find the bounding box of changed pages and columns
+	firstPage = lastPage = None
+	firstCol = width
+	lastCol = -1
+	for page in range(pages):
+		start = 1 + page * width
+		if buf[start:start + width] == prevBuffer[start:start + width]:
+			continue
+		if firstPage is None:
+			firstPage = page
+		lastPage = page
+		col = 0
+		while buf[start + col] == prevBuffer[start + col]:
+			col += 1
+		firstCol = min(firstCol, col)
+		col = width - 1
+		while buf[start + col] == prevBuffer[start + col]:
+			col -= 1
+		lastCol = max(lastCol, col)
+	if firstPage is None:
+		return
+
+	if (lastPage - firstPage + 1) * (lastCol - firstCol + 1) > FULL_REFRESH_RATIO * pages * width:
+		disp.show()
+	else:
+		# Set the column and page address window, then write only that part of the framebuffer
+		for cmd in (0x21, firstCol, lastCol, 0x22, firstPage, lastPage):
+			disp.write_cmd(cmd)
+		data = bytearray([0x40])
+		for page in range(firstPage, lastPage + 1):
+			start = 1 + page * width
+			data += buf[start + firstCol:start + lastCol + 1]
+		with disp.i2c_device:
+			disp.i2c_device.write(data)
+	prevBuffer[:] = buf
+	
+def frameKey(station, condition):
+	return (station, condition.flightCategory, condition.obsTime.strftime("%H:%MZ"),
+		condition.windDir, condition.windSpeed, condition.windGust, condition.windGustSpeed,
+		condition.vis, condition.obs, condition.tempC, condition.dewpointC, condition.altimHg,
+		tuple((skyIter["cover"], skyIter["base"]) for skyIter in condition.skyConditions))
+
+def renderMetar(width, height, station, condition):
 	padding = -2
 	x = 0
 	image = Image.new("1", (width, height))
@@ -48,22 +157,19 @@ def outputMetar(disp, station, condition):
 	top = padding
 	bottom = height - padding
 
-	fontLarge = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf', 16)
-	fontSmall = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf', 10)
-	
 	draw.line([(x + 62, top + 18), (x + 62, bottom)], fill=255, width=1)
 	
-	draw.text((x, top + 0), station + "-" + condition["flightCategory"], font=fontLarge, fill=255)
-	draw.text((x + 90, top + 0), condition["obsTime"].strftime("%H:%MZ"), font=fontSmall, fill=255)
+	draw.text((x, top + 0), station + "-" + condition.flightCategory, font=fontLarge, fill=255)
+	draw.text((x + 90, top + 0), condition.obsTime.strftime("%H:%MZ"), font=fontSmall, fill=255)
 	
-	draw.text((x, top + 15), condition["windDir"] + "@" + str(condition["windSpeed"]) + ("G" + str(condition["windGustSpeed"]) if condition["windGust"] else ""), font=fontSmall, fill=255)
-	draw.text((x + 64, top + 15), str(condition["vis"]) + "SM " + condition["obs"], font=fontSmall, fill=255)
-	draw.text((x, top + 25), str(condition["tempC"]) + "C/" + str(condition["dewpointC"]) + "C", font=fontSmall, fill=255)
-	draw.text((x + 64, top + 25), "A" + str(condition["altimHg"]) + "Hg", font=fontSmall, fill=255)
+	draw.text((x, top + 15), condition.windDir + "@" + str(condition.windSpeed) + ("G" + str(condition.windGustSpeed) if condition.windGust else ""), font=fontSmall, fill=255)
+	draw.text((x + 64, top + 15), str(condition.vis) + "SM " + condition.obs, font=fontSmall, fill=255)
+	draw.text((x, top + 25), str(condition.tempC) + "C/" + str(condition.dewpointC) + "C", font=fontSmall, fill=255)
+	draw.text((x + 64, top + 25), "A" + str(condition.altimHg) + "Hg", font=fontSmall, fill=255)
 	yOff = 35
 	xOff = 0
 	NewLine = False
-	for skyIter in condition["skyConditions"]:
+	for skyIter in condition.skyConditions:
 		draw.text((x + xOff, top + yOff), skyIter["cover"] + ("@" + str(skyIter["base"]) if skyIter["base"] > 0 else ""), font=fontSmall, fill=255)
 		if NewLine:
 			yOff += 10
@@ -72,5 +178,24 @@ def outputMetar(disp, station, condition):
 		else:
 			xOff = 64
 			NewLine = True
+	return image
+
+def outputMetar(disp, station, condition):
+	global lastFrameKey
+	if noDisplayLibraries:
+		return
+
+	key = frameKey(station, condition)
+	if key == lastFrameKey:
+		return
+	image = frameCache.get(key)
+	if image is not None:
+		frameCache.move_to_end(key)
+	else:
+		image = renderMetar(disp.width, disp.height, station, condition)
+		frameCache[key] = image
+		if len(frameCache) > FRAME_CACHE_SIZE:
+			frameCache.popitem(last=False)
 	disp.image(image)
-	disp.show()
\ No newline at end of file
+	flushDisplay(disp)
+	lastFrameKey = key
\ No newline at end of file
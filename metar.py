@@ -1,23 +1,26 @@
 #!/usr/bin/env python3
 import json
-import urllib.request
-import xml.etree.ElementTree as ET
 import board
 import neopixel
 import time
 import datetime
 import math
+import itertools
 import requests
+import requests.adapters
+import urllib3.util.retry
 import re
+import concurrent.futures
+import collections
 
 try:
-    import astral
+    import numpy
 except ImportError:
-    astral = None
+    numpy = None
 try:
-    import displaymetar
+    import orjson
 except ImportError:
-    displaymetar = None
+    orjson = None
 
 # metar.py script iteration 1.7.0 (added fltCat fallback by nearest airport)
 
@@ -58,6 +61,10 @@ DIM_TIME_START                   = datetime.time(19,0)
 LED_BRIGHTNESS_DIM               = 0.1
 USE_SUNRISE_SUNSET               = True
 LOCATION                         = "Detroit"
+# Optionally set (latitude, longitude) to skip the city lookup, requires astral 2.x
+LOCATION_COORDINATES             = None
+# Sunrise/sunset times are calculated once per day and cached in this file
+SUN_CACHE_FILE                   = "/Path/To/suncache.json"
 
 ACTIVATE_EXTERNAL_METAR_DISPLAY  = True
 DISPLAY_ROTATION_SPEED           = 5.0
@@ -68,14 +75,61 @@ OFFSET_LEGEND_BY                 = 0
 # Replace missing fltCat with nearest valid station's fltCat
 REPLACE_CAT_WITH_CLOSEST         = True
 
+# METAR responses are cached in this file, reruns within METAR_CACHE_SECONDS reuse them without
+# a request and later runs only download the data again if the server reports it changed
+METAR_CACHE_FILE                 = "/Path/To/metarcache.json"
+METAR_CACHE_SECONDS              = 60
+
+# Created while the LEDs are lit, so pixelsoff.py only starts the LED driver when there is something
+# to turn off, keep this the same as LIT_FILE in pixelsoff.py. It has to survive a reboot, the strip
+# stays lit as long as it has power, so don't put it on a tmpfs like /run or /tmp
+LIT_FILE                         = "/home/pi/metarmap.lit"
+
+# Print the color of every LED on every animation cycle
+VERBOSE                          = False
+
 # ---------------------------------------------------------------------------
 # ------------END OF CONFIGURATION-------------------------------------------
 # ---------------------------------------------------------------------------
 
 print("Running metar.py at " + datetime.datetime.now().strftime('%d/%m/%Y %H:%M'))
 
+# --- Sunrise/sunset cache helpers ---
+def read_sun_cache(location, date):
+    try:
+        with open(SUN_CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache["location"] == location and cache["date"] == date.isoformat():
+            return (datetime.datetime.strptime(cache["sunrise"], "%H:%M:%S").time(),
+                    datetime.datetime.strptime(cache["sunset"], "%H:%M:%S").time())
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def write_sun_cache(location, date, sunrise, sunset):
+    try:
+        with open(SUN_CACHE_FILE, "w") as f:
+            json.dump({"location": location, "date": date.isoformat(),
+                       "sunrise": sunrise.strftime("%H:%M:%S"), "sunset": sunset.strftime("%H:%M:%S")}, f)
+    except IOError:
+        print("Warning: Could not write sunrise/sunset cache " + SUN_CACHE_FILE)
+
 # Figure out sunrise/sunset times if astral is being used
-if astral is not None and USE_SUNRISE_SUNSET:
+sunLocation = LOCATION if LOCATION_COORDINATES is None else "{:.4f},{:.4f}".format(*LOCATION_COORDINATES)
+sunDate = datetime.datetime.now().date()
+sunTimes = read_sun_cache(sunLocation, sunDate) if USE_SUNRISE_SUNSET else None
+# astral is only imported when today's times aren't cached yet
+astral = None
+if sunTimes is None and USE_SUNRISE_SUNSET:
+    try:
+        import astral
+    except ImportError:
+        pass
+if sunTimes is not None:
+    BRIGHT_TIME_START, DIM_TIME_START = sunTimes
+    print("Sunrise:" + BRIGHT_TIME_START.strftime('%H:%M') + " Sunset:" + DIM_TIME_START.strftime('%H:%M') + " (cached)")
+elif astral is not None and USE_SUNRISE_SUNSET:
+    sunCalculated = False
     try:
         ast = astral.Astral()
         try:
@@ -84,21 +138,32 @@ if astral is not None and USE_SUNRISE_SUNSET:
             print("Error: Location not recognized, please check list of supported cities and reconfigure")
         else:
             print(city)
-            sun = city.sun(date = datetime.datetime.now().date(), local = True)
+            sun = city.sun(date = sunDate, local = True)
             BRIGHT_TIME_START = sun['sunrise'].time()
             DIM_TIME_START = sun['sunset'].time()
+            sunCalculated = True
     except AttributeError:
-        import astral.geocoder
         import astral.sun
-        try:
-            city = astral.geocoder.lookup(LOCATION, astral.geocoder.database())
-        except KeyError:
-            print("Error: Location not recognized, please check list of supported cities and reconfigure")
-        else:
-            print(city)
-            sun = astral.sun.sun(city.observer, date = datetime.datetime.now().date(), tzinfo=city.timezone)
+        if LOCATION_COORDINATES is not None:
+            # Use the coordinates directly in the local timezone of the Pi, no city database needed
+            sun = astral.sun.sun(astral.Observer(*LOCATION_COORDINATES), date = sunDate, tzinfo=datetime.datetime.now().astimezone().tzinfo)
             BRIGHT_TIME_START = sun['sunrise'].time()
             DIM_TIME_START = sun['sunset'].time()
+            sunCalculated = True
+        else:
+            import astral.geocoder
+            try:
+                city = astral.geocoder.lookup(LOCATION, astral.geocoder.database())
+            except KeyError:
+                print("Error: Location not recognized, please check list of supported cities and reconfigure")
+            else:
+                print(city)
+                sun = astral.sun.sun(city.observer, date = sunDate, tzinfo=city.timezone)
+                BRIGHT_TIME_START = sun['sunrise'].time()
+                DIM_TIME_START = sun['sunset'].time()
+                sunCalculated = True
+    if sunCalculated:
+        write_sun_cache(sunLocation, sunDate, BRIGHT_TIME_START, DIM_TIME_START)
     print("Sunrise:" + BRIGHT_TIME_START.strftime('%H:%M') + " Sunset:" + DIM_TIME_START.strftime('%H:%M'))
 
 # Initialize the LED strip
@@ -113,6 +178,8 @@ pixels = neopixel.NeoPixel(LED_PIN, LED_COUNT, brightness = LED_BRIGHTNESS_DIM i
 with open("/Path/To/airports") as f:
     airports = f.readlines()
 airports = [x.strip() for x in airports]
+# LED index and station of every LED that isn't a NULL placeholder, NULL LEDs just stay off
+activeLeds = [(i, airportcode) for i, airportcode in enumerate(airports) if airportcode != "NULL"]
 
 try:
     with open("/Path/To/displayairports") as f2:
@@ -132,59 +199,200 @@ if len(airports) > LED_COUNT:
     quit()
 
 # --- Safe parsing helpers ---
+# Most values already arrive as numbers from the JSON, only fall back to string parsing otherwise
 def safe_int(value, default=0):
+    if value is None:
+        return default
     try:
+        if type(value) is int:
+            return value
+        if type(value) is float:
+            return int(value)
         return int(float(str(value).strip() or default))
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return default
 
 def safe_float(value, default=0.0):
+    if value is None:
+        return default
     try:
+        if type(value) is float:
+            return value
+        if type(value) is int:
+            return float(value)
         return float(str(value).strip() or default)
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return default
 
 def safe_str(value, default=""):
-    return str(value).strip() if value not in [None, "None"] else default
+    if type(value) is str:
+        return value.strip() if value != "None" else default
+    return str(value).strip() if value is not None else default
 
 def safe_round(value, default=0.0):
+    if value is None:
+        return default
     try:
+        if type(value) is int or type(value) is float:
+            return round(value)
         return round(float(str(value).strip() or default))
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return default
 
  # -- Take nearest valid station's fltCat if missing --
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371.0  # km
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_term(lat1, lon1, coslat1, lat2, lon2, coslat2):
+    # Inner haversine term for coordinates already in radians, distance grows with it
+    return math.sin((lat2 - lat1)/2)**2 + coslat1 * coslat2 * math.sin((lon2 - lon1)/2)**2
+
+def haversine_distance(a):
+    return 2 * EARTH_RADIUS_KM * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def unit_vectors(stations):
+    # Stations as points on the unit sphere, the straight line distance between two points
+    # orders stations the same way as the distance along the surface
+    lat = numpy.radians([s["lat"] for s in stations])
+    lon = numpy.radians([s["lon"] for s in stations])
+    return numpy.column_stack((numpy.cos(lat) * numpy.cos(lon), numpy.cos(lat) * numpy.sin(lon), numpy.sin(lat)))
+
+def nearest_stations(missing, valid):
+    # Returns (nearest valid station, distance in km) for each missing station
+    if numpy is not None:
+        # scipy is only needed for this fallback, so it isn't imported at startup
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            cKDTree = None
+        if cKDTree is not None:
+            chord, nearest_idx = cKDTree(unit_vectors(valid)).query(unit_vectors(missing), k=1)
+            dist = 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.minimum(chord / 2, 1.0))
+            return [(valid[j], float(d)) for j, d in zip(nearest_idx, dist)]
+
+        # Compute the whole missing x valid distance matrix in one vectorized pass
+        lat1 = numpy.radians([s["lat"] for s in missing])[:, None]
+        lon1 = numpy.radians([s["lon"] for s in missing])[:, None]
+        lat2 = numpy.radians([s["lat"] for s in valid])[None, :]
+        lon2 = numpy.radians([s["lon"] for s in valid])[None, :]
+        a = numpy.sin((lat2 - lat1)/2)**2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1)/2)**2
+        dist = 2 * EARTH_RADIUS_KM * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+        nearest_idx = dist.argmin(axis=1)
+        return [(valid[j], float(dist[k, j])) for k, j in enumerate(nearest_idx)]
+
+    # Without numpy convert every station to radians once and only finish the distance
+    # calculation for the winner, the haversine term alone is enough to compare stations
+    def to_radians(s):
+        lat = math.radians(s["lat"])
+        return lat, math.radians(s["lon"]), math.cos(lat)
+    validRadians = [(ref, to_radians(ref)) for ref in valid]
+    result = []
+    for s in missing:
+        point = to_radians(s)
+        nearest = None
+        nearest_term = float("inf")
+        for ref, refPoint in validRadians:
+            term = haversine_term(*point, *refPoint)
+            if term < nearest_term:
+                nearest = ref
+                nearest_term = term
+        result.append((nearest, haversine_distance(nearest_term)))
+    return result
 
 # --- Fetch METAR data ---
-url = f'https://aviationweather.gov/api/data/metar?ids={",".join([item for item in airports if item != "NULL"])}&format=json&taf=false'
-print(url)
+REQUEST_TIMEOUT = 10
+# Retry transient server errors with exponential backoff (1s, 2s, 4s)
+REQUEST_RETRIES = urllib3.util.retry.Retry(total=3, backoff_factor=1, status_forcelist=(500, 502, 503, 504))
+# Large airport lists are split into several requests that are fetched in parallel
+REQUEST_CHUNK_SIZE = 50
+REQUEST_WORKERS = 4
+
+session = requests.Session()
+session.headers.update({"User-Agent": "METARMap/1.7", "Accept-Encoding": "gzip, deflate"})
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=REQUEST_WORKERS, max_retries=REQUEST_RETRIES))
+
+def fetch_metars(url, cached):
+    # Returns the METAR data for url and the cache entry to store for it
+    if cached is not None and time.time() - cached["time"] < METAR_CACHE_SECONDS:
+        return cached["data"], cached
+
+    headers = {}
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached is not None and cached.get("lastModified"):
+        headers["If-Modified-Since"] = cached["lastModified"]
+    req = session.get(url, timeout=REQUEST_TIMEOUT, headers=headers)
+    if req.status_code == 304 and cached is not None:
+        # Not modified since the cached response
+        return cached["data"], dict(cached, time=time.time())
+
+    # Parse the raw bytes directly, skipping the text decode of the response
+    data = orjson.loads(req.content) if orjson is not None else json.loads(req.content)
+    return data, {"time": time.time(), "etag": req.headers.get("ETag"), "lastModified": req.headers.get("Last-Modified"), "data": data}
+
+try:
+    with open(METAR_CACHE_FILE, "rb") as f:
+        metarCache = orjson.loads(f.read()) if orjson is not None else json.load(f)
+except (IOError, ValueError):
+    metarCache = {}
+
+# The requests run in the background so the external display can start up while waiting on the network
+# A station can drive several LEDs, but only needs to be requested once
+stations = list(dict.fromkeys(airportcode for i, airportcode in activeLeds))
+chunks = [stations[i:i + REQUEST_CHUNK_SIZE] for i in range(0, len(stations), REQUEST_CHUNK_SIZE)] or [stations]
+with concurrent.futures.ThreadPoolExecutor(max_workers=REQUEST_WORKERS) as executor:
+    fetches = []
+    for chunk in chunks:
+        url = f'https://aviationweather.gov/api/data/metar?ids={",".join(chunk)}&format=json&taf=false'
+        print(url)
+        fetches.append((url, executor.submit(fetch_metars, url, metarCache.get(url))))
+
+    # Start up external display output, the display libraries are only imported when it is
+    # turned on and the import overlaps with the requests
+    disp = None
+    displaymetar = None
+    if ACTIVATE_EXTERNAL_METAR_DISPLAY:
+        try:
+            import displaymetar
+        except ImportError:
+            pass
+    if displaymetar is not None:
+        print("setting up external display")
+        disp = displaymetar.startDisplay()
+        displaymetar.clearScreen(disp)
+
+    output = []
+    newMetarCache = {}
+    for url, fetch in fetches:
+        data, newMetarCache[url] = fetch.result()
+        output += data
 
-req = requests.get(url)
-output = json.loads(req.text)
+try:
+    with open(METAR_CACHE_FILE, "wb") as f:
+        f.write(orjson.dumps(newMetarCache) if orjson is not None else json.dumps(newMetarCache).encode())
+except IOError:
+    print("Warning: Could not write METAR cache " + METAR_CACHE_FILE)
 
 # --- Parse response ---
+# Compact record of the fields used for the LEDs and the external display
+Conditions = collections.namedtuple("Conditions", ["flightCategory", "obsTime", "windDir", "windSpeed", "windGust", "windGustSpeed",
+                                                   "vis", "obs", "tempC", "dewpointC", "altimHg", "skyConditions", "lightning"])
+
 station_count = 0
 conditionDict = {}
 station_list = []
 station_meta = []
 
-# Lightning Pattern
+# Lightning Pattern, combined with TSNO (thunderstorm sensor not operational) so a METAR is scanned only once
 pattern = re.compile(
+    r"\b(?P<tsno>TSNO)\b|"
     r"\b(VCTS|[-+]?TS(?:RA|SN|PL|GR|SG|GS|SH|UP|SP|SNRA)?|LTG(?:IC|CC|CG|CA)?|(?:FRQ|OCNL|CONS|DSNT)\s+LTG)\b"
 )
 
 
+# Only the fields that are actually used for the LEDs, the display and the nearest station
+# fallback are parsed, the rest of the METAR record is ignored
 for location in output:
     icaoId = safe_str(location.get("icaoId"))
-    receiptTime = safe_str(location.get("receiptTime"))
     # 1. Pulls Obs time
     obsTime = safe_str(location.get("obsTime"))
     # 2. Converts to datetime for display
@@ -194,7 +402,6 @@ for location in output:
         # Default to epoch if invalid 00:00Z
         obsTime = datetime.datetime(1970, 1, 1)
 
-    reportTimeE = safe_str(location.get("reportTime"))
     temp = safe_round(location.get("temp", 0.0))
     dewp = safe_round(location.get("dewp", 0.0))
     wdir = safe_str(location.get("wdir"))
@@ -202,58 +409,47 @@ for location in output:
     wgst_speed = safe_int(location.get("wgst", 0))
     wgst = True if ALWAYS_BLINK_FOR_GUSTS or wgst_speed > WIND_BLINK_THRESHOLD else False
 
-    visib_str = str(location.get("visib") or "0").replace("+", "").strip()
-    visib = safe_int(visib_str)
+    # Visibility is reported as a number, or a string like "10+" for 10SM and greater
+    visib = location.get("visib")
+    visib = safe_int(visib.replace("+", "") if type(visib) is str else visib)
 
     altim = safe_float(location.get("altim", 0.0))
-    slp = safe_float(location.get("slp", 0.0))
     wxString = safe_str(location.get("wxString"))
-    presTend = safe_float(location.get("presTend", 0.0))
-    maxT = safe_float(location.get("maxT", 0.0))
-    minT = safe_float(location.get("minT", 0.0))
-    maxT24 = safe_float(location.get("maxT24", 0.0))
-    minT24 = safe_float(location.get("minT24", 0.0))
-    precip = safe_float(location.get("precip", 0.0))
-    pcp3hr = safe_float(location.get("pcp3hr", 0.0))
-    pcp6hr = safe_float(location.get("pcp6hr", 0.0))
-    pcp24hr = safe_float(location.get("pcp24hr", 0.0))
-    snow = safe_float(location.get("snow", 0.0))
-    vertVis = safe_int(location.get("vertVis", 0))
-    metarType = safe_str(location.get("metarType"))
     rawOb = safe_str(location.get("rawOb"))
     lat = safe_float(location.get("lat", 0.0))
     lon = safe_float(location.get("lon", 0.0))
-    elev = safe_int(location.get("elev", 0))
-    name = safe_str(location.get("name"))
     clouds = location.get("clouds") or []
 
-
     fltCat = safe_str(location.get("fltCat"))
 
     # --- Lightning detection ---
-    lightning = (
-        not re.search(r"\bTSNO\b", rawOb.upper()) and
-        bool(re.search(pattern, rawOb.upper()))
-    )
+    # Only the lightning animation uses this, so don't scan the METAR when it is turned off
+    lightning = False
+    if ACTIVATE_LIGHTNING_ANIMATION:
+        for match in pattern.finditer(rawOb.upper()):
+            if match.lastgroup == "tsno":
+                lightning = False
+                break
+            lightning = True
 
     # --- Populate results ---
     if icaoId:
         station_count += 1
-        conditionDict[icaoId] = {
-            "flightCategory": fltCat,
-            "obsTime": obsTime,
-            "windDir": wdir,
-            "windSpeed": wspd,
-            "windGust": wgst,
-            "windGustSpeed": wgst_speed,
-            "vis": visib,
-            "obs": wxString,
-            "tempC": temp,
-            "dewpointC": dewp,
-            "altimHg": altim,
-            "skyConditions": clouds,
-            "lightning": lightning,
-        }
+        conditionDict[icaoId] = Conditions(
+            flightCategory=fltCat,
+            obsTime=obsTime,
+            windDir=wdir,
+            windSpeed=wspd,
+            windGust=wgst,
+            windGustSpeed=wgst_speed,
+            vis=visib,
+            obs=wxString,
+            tempC=temp,
+            dewpointC=dewp,
+            altimHg=altim,
+            skyConditions=clouds,
+            lightning=lightning,
+        )
 
         # --- store for lookup ---
         station_meta.append({
@@ -273,103 +469,130 @@ print(f"Parsed {station_count} stations.")
 # --- fill missing fltCat by nearest valid station ---
 valid_stations = [s for s in station_meta if s["fltCat"] and s["lat"] and s["lon"]]
 
-for s in station_meta:
-    if not s["fltCat"] and s["lat"] and s["lon"] and valid_stations and REPLACE_CAT_WITH_CLOSEST:
-        nearest = None
-        nearest_dist = float("inf")
-        for ref in valid_stations:
-            dist = haversine(s["lat"], s["lon"], ref["lat"], ref["lon"])
-            if dist < nearest_dist:
-                nearest = ref
-                nearest_dist = dist
+missing_stations = [s for s in station_meta if not s["fltCat"] and s["lat"] and s["lon"]]
+
+if missing_stations and valid_stations and REPLACE_CAT_WITH_CLOSEST:
+    for s, (nearest, nearest_dist) in zip(missing_stations, nearest_stations(missing_stations, valid_stations)):
         if nearest:
-            conditionDict[s["icaoId"]]["flightCategory"] = nearest["fltCat"]
+            conditionDict[s["icaoId"]] = conditionDict[s["icaoId"]]._replace(flightCategory=nearest["fltCat"])
             print(f"{s['icaoId']} missing fltCat — using nearest {nearest['icaoId']} ({nearest_dist:.1f} km, {nearest['fltCat']})")
 
+# Setting LED colors based on weather conditions
+# Without any animation a single frame is shown and the script ends
+runTime = BLINK_TOTALTIME_SECONDS if (ACTIVATE_WINDCONDITION_ANIMATION or ACTIVATE_LIGHTNING_ANIMATION or ACTIVATE_EXTERNAL_METAR_DISPLAY) else 0
+
+# Lookup table of LED colors by (flightCategory, windy, lightning, highWinds)
+COLOR_TABLE = {}
+for category, baseColor, fadeColor in (("VFR", COLOR_VFR, COLOR_VFR_FADE), ("MVFR", COLOR_MVFR, COLOR_MVFR_FADE),
+                                       ("IFR", COLOR_IFR, COLOR_IFR_FADE), ("LIFR", COLOR_LIFR, COLOR_LIFR_FADE)):
+    windyColor = fadeColor if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR
+    for windy, lightningConditions, highWinds in itertools.product((False, True), repeat = 3):
+        COLOR_TABLE[(category, windy, lightningConditions, highWinds)] = COLOR_LIGHTNING if lightningConditions else COLOR_HIGH_WINDS if highWinds else windyColor if windy else baseColor
+
+def build_color_tables(ledCount, activeLeds, conditionDict):
+    # Returns per LED the (color, VERBOSE log line) for windCycle False and for windCycle True
+    ledTable = [((COLOR_CLEAR, None), (COLOR_CLEAR, None))] * ledCount
+    for i, airportcode in activeLeds:
+        conditions = conditionDict.get(airportcode, None)
+        flightCategory = conditions.flightCategory if conditions is not None else None
+        windyPossible = conditions is not None and ACTIVATE_WINDCONDITION_ANIMATION and (conditions.windSpeed >= WIND_BLINK_THRESHOLD or conditions.windGust == True)
+        highWindsPossible = windyPossible and HIGH_WINDS_THRESHOLD != -1 and (conditions.windSpeed >= HIGH_WINDS_THRESHOLD or conditions.windGustSpeed >= HIGH_WINDS_THRESHOLD)
+        lightningPossible = conditions is not None and ACTIVATE_LIGHTNING_ANIMATION and conditions.lightning == True
+
+        cycles = []
+        for windCycle in (False, True):
+            windy = windyPossible and windCycle
+            highWinds = highWindsPossible and windCycle
+            lightningConditions = lightningPossible and not windCycle
+            color = COLOR_TABLE.get((flightCategory, windy, lightningConditions, highWinds), COLOR_CLEAR)
+            logLine = ("Setting LED " + str(i) + " for " + airportcode + " to " + ("lightning " if lightningConditions else "") + ("very " if highWinds else "") + ("windy " if windy else "") + (flightCategory if flightCategory is not None else "None") + " " + str(color)) if VERBOSE else None
+            cycles.append((color, logLine))
+        ledTable[i] = tuple(cycles)
+    return ledTable
+
+ledTable = build_color_tables(len(airports), activeLeds, conditionDict)
+
+def build_legend(windCycle):
+    legend = [COLOR_VFR, COLOR_MVFR, COLOR_IFR, COLOR_LIFR]
+    if ACTIVATE_LIGHTNING_ANIMATION or ACTIVATE_WINDCONDITION_ANIMATION:
+        legend.append((COLOR_LIGHTNING if windCycle else COLOR_VFR) if ACTIVATE_LIGHTNING_ANIMATION else COLOR_CLEAR) # lightning
+    if ACTIVATE_WINDCONDITION_ANIMATION:
+        legend.append(COLOR_VFR if not windCycle else (COLOR_VFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR))    # windy
+        if HIGH_WINDS_THRESHOLD != -1:
+            legend.append(COLOR_VFR if not windCycle else COLOR_HIGH_WINDS)  # high winds
+    return legend
+
+def build_frame(windCycle):
+    frame = [cycles[windCycle][0] for cycles in ledTable]
+    logLines = [cycles[windCycle][1] for cycles in ledTable if cycles[windCycle][1] is not None]
 
-# Start up external display output
-disp = None
-if displaymetar is not None and ACTIVATE_EXTERNAL_METAR_DISPLAY:
-    print("setting up external display")
-    disp = displaymetar.startDisplay()
-    displaymetar.clearScreen(disp)
-
+    # Legend
+    if SHOW_LEGEND:
+        frame += [COLOR_CLEAR] * OFFSET_LEGEND_BY + build_legend(windCycle)
+    return frame, "\n".join(logLines)
 
-# Setting LED colors based on weather conditions
-looplimit = int(round(BLINK_TOTALTIME_SECONDS / BLINK_SPEED)) if (ACTIVATE_WINDCONDITION_ANIMATION or ACTIVATE_LIGHTNING_ANIMATION or ACTIVATE_EXTERNAL_METAR_DISPLAY) else 1
+# The METAR data doesn't change while the script runs, so both animation half-cycles
+# are rendered once here and each tick only picks the frame for the current windCycle
+frames = [build_frame(False), build_frame(True)]
+# With no windy or lightning stations and no display to rotate, nothing changes after the
+# first frame, so show it once and end like a run without animations
+if frames[False][0] == frames[True][0] and disp is None:
+    runTime = 0
 
 windCycle = False
 displayTime = 0.0
 displayAirportCounter = 0
-display_list = displayairports if displayairports else station_list
-numAirports = len(display_list)
-while looplimit > 0:
-    i = 0
-    for airportcode in airports:
-        # Skip NULL entries
-        if airportcode == "NULL":
-            i += 1
-            continue
-
-        color = COLOR_CLEAR
-        conditions = conditionDict.get(airportcode, None)
-        windy = False
-        highWinds = False
-        lightningConditions = False
-
-        if conditions != None:
-            windy = True if (ACTIVATE_WINDCONDITION_ANIMATION and windCycle == True and (conditions["windSpeed"] >= WIND_BLINK_THRESHOLD or conditions["windGust"] == True)) else False
-            highWinds = True if (windy and HIGH_WINDS_THRESHOLD != -1 and (conditions["windSpeed"] >= HIGH_WINDS_THRESHOLD or conditions["windGustSpeed"] >= HIGH_WINDS_THRESHOLD)) else False
-            lightningConditions = True if (ACTIVATE_LIGHTNING_ANIMATION and windCycle == False and conditions["lightning"] == True) else False
-            if conditions["flightCategory"] == "VFR":
-                color = COLOR_VFR if not (windy or lightningConditions) else COLOR_LIGHTNING if lightningConditions else COLOR_HIGH_WINDS if highWinds else (COLOR_VFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR) if windy else COLOR_CLEAR
-            elif conditions["flightCategory"] == "MVFR":
-                color = COLOR_MVFR if not (windy or lightningConditions) else COLOR_LIGHTNING if lightningConditions else COLOR_HIGH_WINDS if highWinds else (COLOR_MVFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR) if windy else COLOR_CLEAR
-            elif conditions["flightCategory"] == "IFR":
-                color = COLOR_IFR if not (windy or lightningConditions) else COLOR_LIGHTNING if lightningConditions else COLOR_HIGH_WINDS if highWinds else (COLOR_IFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR) if windy else COLOR_CLEAR
-            elif conditions["flightCategory"] == "LIFR":
-                color = COLOR_LIFR if not (windy or lightningConditions) else COLOR_LIGHTNING if lightningConditions else COLOR_HIGH_WINDS if highWinds else (COLOR_LIFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR) if windy else COLOR_CLEAR
-            else:
-                color = COLOR_CLEAR
-
-        print("Setting LED " + str(i) + " for " + airportcode + " to " + ("lightning " if lightningConditions else "") + ("very " if highWinds else "") + ("windy " if windy else "") + (conditions["flightCategory"] if conditions != None else "None") + " " + str(color))
-        pixels[i] = color
-        i += 1
-
-    # Legend
-    if SHOW_LEGEND:
-        pixels[i + OFFSET_LEGEND_BY] = COLOR_VFR
-        pixels[i + OFFSET_LEGEND_BY + 1] = COLOR_MVFR
-        pixels[i + OFFSET_LEGEND_BY + 2] = COLOR_IFR
-        pixels[i + OFFSET_LEGEND_BY + 3] = COLOR_LIFR
-        if ACTIVATE_LIGHTNING_ANIMATION == True:
-            pixels[i + OFFSET_LEGEND_BY + 4] = COLOR_LIGHTNING if windCycle else COLOR_VFR # lightning
-        if ACTIVATE_WINDCONDITION_ANIMATION == True:
-            pixels[i+ OFFSET_LEGEND_BY + 5] = COLOR_VFR if not windCycle else (COLOR_VFR_FADE if FADE_INSTEAD_OF_BLINK else COLOR_CLEAR)    # windy
-            if HIGH_WINDS_THRESHOLD != -1:
-                pixels[i + OFFSET_LEGEND_BY + 6] = COLOR_VFR if not windCycle else COLOR_HIGH_WINDS  # high winds
-
-    # Update actual LEDs all at once
-    pixels.show()
+# Pair each display airport with its conditions once instead of looking them up every tick
+displayConditions = [(station, conditionDict.get(station, None)) for station in station_list]
+numAirports = len(displayConditions)
+shownFrame = None
+# Ticks are scheduled against a monotonic clock, so the time spent building and pushing
+# each frame doesn't add up and the script really ends after BLINK_TOTALTIME_SECONDS
+nextTick = time.monotonic()
+endTime = nextTick + runTime
+while True:
+    frame, frameLog = frames[windCycle]
+    if VERBOSE:
+        print(frameLog)
+
+    # The LEDs keep their colors, so only push a frame that differs from what is already lit,
+    # e.g. with no windy or lightning stations both half-cycles are the same
+    if frame != shownFrame:
+        # Write the whole frame, including the legend, to the strip with a single slice assignment
+        pixels[0:len(frame)] = frame
+
+        # Let pixelsoff.py know the LEDs need to be turned off
+        if shownFrame is None:
+            try:
+                open(LIT_FILE, "w").close()
+            except IOError:
+                print("Warning: Could not write " + LIT_FILE + ", pixelsoff.py will not turn the LEDs off")
+
+        # Update actual LEDs all at once
+        pixels.show()
+        shownFrame = frame
 
     if disp is not None:
+        displayStation, displayCondition = displayConditions[displayAirportCounter]
         if displayTime <= DISPLAY_ROTATION_SPEED:
-            displaymetar.outputMetar(disp, station_list[displayAirportCounter],
-                                     conditionDict.get(station_list[displayAirportCounter], None))
+            # Only announce each airport once when it comes up, not on every tick
+            if displayTime == 0.0:
+                print("showing METAR Display for " + displayStation)
+            displaymetar.outputMetar(disp, displayStation, displayCondition)
             displayTime += BLINK_SPEED
-            print("showing METAR Display for " + station_list[displayAirportCounter])
             # Print length of time showing current airport
-            if DISPLAY_ROTATION_SPEED - displayTime > 0:
+            if VERBOSE and DISPLAY_ROTATION_SPEED - displayTime > 0:
                 print("for another " + str(int(DISPLAY_ROTATION_SPEED - displayTime)) + " seconds")
         else:
             displayTime = 0.0
             displayAirportCounter = displayAirportCounter + 1 if displayAirportCounter < numAirports - 1 else 0
-            print("showing METAR Display for " + station_list[displayAirportCounter])
 
     # Switching between animation cycles
-    time.sleep(BLINK_SPEED)
-    windCycle = False if windCycle else True
-    looplimit -= 1
+    windCycle = not windCycle
+    nextTick += BLINK_SPEED
+    if nextTick >= endTime:
+        break
+    time.sleep(max(0.0, nextTick - time.monotonic()))
 
 print()
 print("Done")
@@ -1,16 +1,42 @@
+import os
 import board
-import neopixel
-try:
-	import displaymetar
-except ImportError:
-	displaymetar = None
 
-pixels = neopixel.NeoPixel(board.D18, 50)
+# NeoPixel LED Configuration, keep these the same as in metar.py
+LED_COUNT	= 50
+LED_PIN		= board.D18
+# Created by metar.py while the LEDs are lit, keep this the same as LIT_FILE in metar.py
+LIT_FILE	= "/home/pi/metarmap.lit"
+# Set to False if there is no external display, keep this the same as in metar.py
+ACTIVATE_EXTERNAL_METAR_DISPLAY	= True
 
-pixels.deinit()
+# Turning the display off only needs displaymetar's raw I2C write, none of the display
+# libraries, and without an external display there is nothing to turn off
+displaymetar = None
+if ACTIVATE_EXTERNAL_METAR_DISPLAY:
+	try:
+		import displaymetar
+	except ImportError:
+		pass
 
+# Starting the LED driver is slow, so neopixel is only loaded when metar.py left the LEDs lit
+if os.path.exists(LIT_FILE):
+	import neopixel
+
+	pixels = neopixel.NeoPixel(LED_PIN, LED_COUNT, auto_write = False)
+
+	# deinit() alone doesn't reliably clear the strip, so send a single all-off frame first,
+	# the pixel buffer of a new strip is already all zeros so it doesn't need a fill()
+	pixels.show()
+else:
+	pixels = None
+
+# The display only needs its display off command, which goes out on the I2C bus while the
+# LED driver is still sending the all-off frame
 if displaymetar is not None:
-	disp = displaymetar.startDisplay()
-	displaymetar.shutdownDisplay(disp)
+	displaymetar.shutdownDisplay(None)
+
+if pixels is not None:
+	pixels.deinit()
+	os.remove(LIT_FILE)
 
 print("LEDs off")
\ No newline at end of file